@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+On the fly augmentation of image batches for the get_dataset images.
+
+augment_batch applies a random shift, rotation, horizontal flip and brightness
+change to every image of a (n, h, w) or (n, h, w, c) batch at once: the shift,
+rotation and flip are one nearest neighbour gather over the whole batch, with
+edge pixels repeated where the image moves out of frame. augmented_batches
+runs it in a thread pool, a few batches ahead of the training loop, so the
+augmented images only ever exist in memory. Usage:
+
+    X_train, X_test, Y_train, Y_test = get_dataset()
+    for X_batch, Y_batch in augmented_batches(X_train, Y_train, batch_size=32, epochs=10):
+        ...
+
+Run this file to measure the images/sec the pipeline keeps up with.
+"""
+import argparse
+import collections
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from get_dataset import normalize_batch, one_hot
+
+
+def augment_batch(X, rng=np.random, max_shift=0.1, max_rotation=15., flip=0.5, max_brightness=0.1,
+                  out=None):
+    '''
+    Returns a randomly augmented float32 copy of the batch X, into out if given.
+    max_shift is a fraction of the image size, max_rotation is in degrees,
+    flip the probability of a horizontal flip and max_brightness the largest
+    value added to or subtracted from the (0-1) pixels
+    '''
+    X = np.asarray(X)
+    n, h, w = X.shape[:3]
+    shift = np.array([h, w], dtype='float32') * max_shift
+    dy = rng.uniform(-shift[0], shift[0], n).astype('float32')[:, None, None]
+    dx = rng.uniform(-shift[1], shift[1], n).astype('float32')[:, None, None]
+    angle = np.radians(rng.uniform(-max_rotation, max_rotation, n)).astype('float32')
+    cos, sin = np.cos(angle)[:, None, None], np.sin(angle)[:, None, None]
+    mirror = np.where(rng.uniform(size=n) < flip, -1, 1).astype('float32')[:, None, None]
+    # Source pixel of every output pixel, around the centre of the image
+    yy = (np.arange(h, dtype='float32') - (h - 1) / 2.)[None, :, None]
+    xx = (np.arange(w, dtype='float32') - (w - 1) / 2.)[None, None, :] * mirror
+    src_y = -sin * xx + cos * yy - dy + (h - 1) / 2.
+    src_x = cos * xx + sin * yy - dx + (w - 1) / 2.
+    rows = np.clip(np.rint(src_y), 0, h - 1).astype(np.intp)
+    cols = np.clip(np.rint(src_x), 0, w - 1).astype(np.intp)
+    if out is None:
+        out = np.empty(X.shape, dtype='float32')
+    out[...] = X[np.arange(n)[:, None, None], rows, cols]
+    if max_brightness:
+        delta = rng.uniform(-max_brightness, max_brightness, n).astype('float32')
+        out += delta.reshape((n,) + (1,) * (X.ndim - 1))
+        np.clip(out, 0, 1, out=out)
+    return out
+
+def _augment_task(args):
+    X, Y, index, seed, params = args
+    # Fancy indexing copies the rows, so the batch is augmented in place
+    X_batch, Y_batch = np.asarray(X[index]), np.asarray(Y[index])
+    if X_batch.dtype == np.uint8: # Rows of the raw cache, e.g. a DatasetView
+        X_batch = normalize_batch(X_batch)
+    X_batch = X_batch.astype('float32', copy=False)
+    if Y_batch.ndim == 1:
+        Y_batch = one_hot(Y_batch)
+    return augment_batch(X_batch, np.random.RandomState(seed), out=X_batch, **params), Y_batch
+
+def augmented_batches(X, Y, batch_size=32, epochs=1, shuffle=True, workers=2, prefetch_batches=4,
+                      seed=None, index=None, **params):
+    '''
+    Yields (X_batch, Y_batch) with X_batch augmented by augment_batch(**params).
+    X, Y are the get_dataset arrays, or the X, Y of the cache (uint8 images
+    and class ids, normalized here) with index restricting them to the rows
+    of a view: augmented_batches(view.X, view.Y, index=view.index).
+    Batches are made by workers threads, at most workers + prefetch_batches
+    ahead of the consumer. epochs=None repeats forever
+    '''
+    index = np.arange(len(X)) if index is None else np.asarray(index)
+    rng = np.random.RandomState(seed)
+    def tasks():
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            order = rng.permutation(index) if shuffle else index
+            for start in range(0, len(order), batch_size):
+                yield X, Y, order[start:start+batch_size], rng.randint(2 ** 31), params
+            epoch += 1
+    pool = ThreadPool(workers)
+    pending = collections.deque()
+    try:
+        for task in tasks():
+            pending.append(pool.apply_async(_augment_task, (task,)))
+            if len(pending) > workers + prefetch_batches:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Images/sec of augmented_batches')
+    parser.add_argument('--images', type=int, default=2062)
+    parser.add_argument('--img-size', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--epochs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.RandomState(0)
+    X = rng.uniform(size=(args.images, args.img_size, args.img_size)).astype('float32')
+    Y = one_hot(rng.randint(10, size=args.images))
+    print('%8s %12s' % ('workers', 'images/s'))
+    for workers in args.workers:
+        start = time.time()
+        for _ in augmented_batches(X, Y, args.batch_size, args.epochs, workers=workers):
+            pass
+        print('%8d %12.1f' % (workers, args.images * args.epochs / (time.time() - start)))
+
+if __name__ == '__main__':
+    main()
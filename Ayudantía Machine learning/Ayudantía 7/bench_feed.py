@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Steps/sec of Custom_Nnet training with feed_dict inputs versus resident data.
+
+The feed_dict runs use float64 inputs, as the old np.round pipeline produced,
+so they pay the conversion and copy on every step. Usage:
+
+    python bench_feed.py --rows 100000 --batch-sizes 256 4096 0
+
+A batch size of 0 means full batch.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from neural_net import Custom_Nnet
+
+
+def steps_per_sec(X, y, resident, batch_size, epochs, hidden):
+    nn = Custom_Nnet(hidden, ['ReLU'] * len(hidden), epochs=epochs, batch_size=batch_size,
+                     summary_steps=0, resident=resident,
+                     ckpt_path=os.path.join(tempfile.mkdtemp(), 'model.ckpt'))
+    nn.build_graph(X.shape[1])
+    batch = batch_size or X.shape[0]
+    steps = epochs * ((X.shape[0] + batch - 1) // batch)
+    start = time.time()
+    nn.train(X, y)
+    return steps / (time.time() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--hidden', type=int, nargs='+', default=[10, 10])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[256, 4096, 0])
+    parser.add_argument('--epochs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rng = np.random.RandomState(0)
+    X = rng.randn(args.rows, args.cols)
+    y = X.sum(axis=1, keepdims=True) + rng.randn(args.rows, 1)
+    print('%10s %14s %14s %8s' % ('batch', 'feed steps/s', 'resident st/s', 'speedup'))
+    for batch_size in args.batch_sizes:
+        batch_size = batch_size or None
+        fed = steps_per_sec(X, y, False, batch_size, args.epochs, args.hidden)
+        resident = steps_per_sec(X, y, True, batch_size, args.epochs, args.hidden)
+        print('%10s %14.1f %14.1f %7.2fx' % (batch_size or 'full', fed, resident, resident / fed))
+
+if __name__ == '__main__':
+    main()
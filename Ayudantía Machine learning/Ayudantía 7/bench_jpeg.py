@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Images/sec and fidelity of the draft mode JPEG decode versus imread + imresize.
+
+Both decoders run in this process over the same images; fidelity is the MSE
+and PSNR of the draft mode images against the full decode ones. Usage:
+
+    python bench_jpeg.py --dataset Dataset --images 500
+"""
+import argparse
+import time
+
+import numpy as np
+
+import get_dataset
+
+
+def decode_all(paths, fast):
+    get_dataset.fast_decode = fast
+    start = time.time()
+    images = np.stack([get_dataset.get_img(path) for path in paths])
+    return images, len(paths) / (time.time() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--dataset', default='Dataset')
+    parser.add_argument('--images', type=int, default=500, help='0 uses every image')
+    parser.add_argument('--img-size', type=int, default=get_dataset.img_size)
+    args = parser.parse_args(argv)
+
+    get_dataset.img_size = args.img_size
+    paths, _ = get_dataset.list_images(args.dataset)
+    paths = paths[:args.images or None]
+    full, full_rate = decode_all(paths, False)
+    draft, draft_rate = decode_all(paths, True)
+    mse = np.mean((full.astype('float64') - draft) ** 2)
+    psnr = 10 * np.log10(255. ** 2 / mse) if mse else float('inf')
+    print('%d images of %dx%d' % (len(paths), args.img_size, args.img_size))
+    print('%10s %12s' % ('decoder', 'images/s'))
+    print('%10s %12.1f' % ('full', full_rate))
+    print('%10s %12.1f %7.2fx' % ('draft', draft_rate, draft_rate / full_rate))
+    print('MSE %.2f, PSNR %.2f dB' % (mse, psnr))
+
+if __name__ == '__main__':
+    main()
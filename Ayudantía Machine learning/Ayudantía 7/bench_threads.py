@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Training throughput of Custom_Nnet for a grid of thread counts and batch sizes.
+
+Run it on each host to pick intra_op_threads, inter_op_threads and batch_size:
+
+    python bench_threads.py --intra 1 2 4 8 --inter 1 2 --batch-sizes 256 4096
+
+Every setting trains in a fresh process, since tensorflow fixes its thread
+pools the first time a session is created.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from neural_net import Custom_Nnet
+
+
+def _throughput(args):
+    X, y, intra, inter, batch_size, epochs, hidden, resident = args
+    nn = Custom_Nnet(hidden, ['ReLU'] * len(hidden), epochs=epochs, batch_size=batch_size,
+                     summary_steps=0, resident=resident, intra_op_threads=intra, inter_op_threads=inter,
+                     ckpt_path=os.path.join(tempfile.mkdtemp(), 'model.ckpt'))
+    nn.build_graph(X.shape[1])
+    start = time.time()
+    nn.train(X, y)
+    return X.shape[0] * epochs / (time.time() - start)
+
+def main(argv=None):
+    cores = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--hidden', type=int, nargs='+', default=[10, 10])
+    parser.add_argument('--intra', type=int, nargs='+',
+                        default=sorted(set([1, 2, 4, 8, cores]) & set(range(1, cores + 1))))
+    parser.add_argument('--inter', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[256, 4096, 0],
+                        help='0 means full batch')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--resident', action='store_true')
+    args = parser.parse_args(argv)
+
+    rng = np.random.RandomState(0)
+    X = rng.randn(args.rows, args.cols).astype(np.float32)
+    y = X.sum(axis=1, keepdims=True) + rng.randn(args.rows, 1).astype(np.float32)
+    print('%6s %6s %10s %14s' % ('intra', 'inter', 'batch', 'examples/s'))
+    for batch_size in args.batch_sizes:
+        for inter in args.inter:
+            for intra in args.intra:
+                run = (X, y, intra, inter, batch_size or None, args.epochs, args.hidden, args.resident)
+                pool = multiprocessing.Pool(1)
+                try:
+                    rate = pool.apply(_throughput, (run,))
+                finally:
+                    pool.terminate()
+                print('%6d %6d %10s %14.0f' % (intra, inter, batch_size or 'full', rate))
+
+if __name__ == '__main__':
+    main()
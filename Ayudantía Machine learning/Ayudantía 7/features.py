@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Fitted feature transformer for the Base.csv models.
+
+Does the job of the sklearn_pandas pipeline the models were first trained
+with (StandardScaler on the numeric columns, one hot encoding without the last
+dummy on the categorical ones) with NumPy only, so scoring processes can load
+a saved transformer without pandas, sklearn or sklearn_pandas.
+"""
+import numpy as np
+
+
+def _column(data, name):
+    # data is a DataFrame or a dict of arrays
+    values = np.asarray(data[name])
+    if values.dtype == object:
+        values = values.astype(str)
+    return values
+
+class FeatureTransformer(object):
+    """Standardize numeric columns and dummy encode categorical ones.
+
+    The output has the standardized numeric columns first, then for every
+    categorical column one dummy per category except the last, with the
+    categories in order of first appearance (as data[col].factorize() codes
+    them). Unknown categories get all zero dummies.
+    """
+    def __init__(self, numeric, categories):
+        self.numeric = list(numeric)
+        self.categories = list(categories)
+
+    def fit(self, data):
+        values = np.column_stack([_column(data, col).astype(np.float64) for col in self.numeric])
+        self.n_samples_ = values.shape[0]
+        self.mean_ = values.mean(axis=0)
+        self.var_ = values.var(axis=0)
+        self._update_scale()
+        self.categories_ = []
+        for col in self.categories:
+            uniques, first = np.unique(_column(data, col), return_index=True)
+            self.categories_.append(uniques[np.argsort(first)])
+        self._index_categories()
+        return self
+
+    def partial_fit(self, data):
+        '''
+        Updates the numeric means and scales with the rows of data, as if the
+        transformer had been fit on all the rows seen so far. The categories
+        are kept as they are: unseen values can't get a dummy without changing
+        the width the network was built for
+        '''
+        values = np.column_stack([_column(data, col).astype(np.float64) for col in self.numeric])
+        n_a, n_b = self.n_samples_, values.shape[0]
+        if n_b == 0: # Nothing new: the mean and variance of no rows would be NaN
+            return self
+        n = n_a + n_b
+        mean_b, var_b = values.mean(axis=0), values.var(axis=0)
+        delta = mean_b - self.mean_
+        # Chan et al. pairwise update of the mean and variance
+        self.var_ = (self.var_ * n_a + var_b * n_b + delta ** 2 * n_a * n_b / n) / n
+        self.mean_ = self.mean_ + delta * n_b / n
+        self.n_samples_ = n
+        self._update_scale()
+        return self
+
+    def _update_scale(self):
+        self.scale_ = np.sqrt(self.var_)
+        self.scale_[self.scale_ == 0] = 1.0
+
+    def _index_categories(self):
+        self._sorters = [np.argsort(cats) for cats in self.categories_]
+
+    @property
+    def width(self):
+        return len(self.numeric) + sum(len(cats) - 1 for cats in self.categories_)
+
+    def _codes(self, values, i):
+        cats, sorter = self.categories_[i], self._sorters[i]
+        pos = np.searchsorted(cats, values, sorter=sorter)
+        codes = sorter[np.minimum(pos, len(cats) - 1)]
+        codes[cats[codes] != values] = -1
+        return codes
+
+    def transform(self, data, out=None):
+        '''
+        Writes the features of data into out, a float32 matrix of
+        (rows, self.width) that is allocated when not given, and returns it
+        '''
+        rows = len(data[(self.numeric + self.categories)[0]])
+        if out is None:
+            out = np.empty((rows, self.width), dtype=np.float32)
+        for j, col in enumerate(self.numeric):
+            np.subtract(_column(data, col), self.mean_[j], out=out[:, j])
+            out[:, j] /= self.scale_[j]
+        offset = len(self.numeric)
+        out[:, offset:] = 0
+        for i, col in enumerate(self.categories):
+            n_dummies = len(self.categories_[i]) - 1
+            codes = self._codes(_column(data, col), i)
+            hit = np.flatnonzero((codes >= 0) & (codes < n_dummies))
+            out[hit, offset + codes[hit]] = 1
+            offset += n_dummies
+        return out
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+    def save(self, path):
+        arrays = {'numeric': np.array(self.numeric, dtype=str),
+                  'categories': np.array(self.categories, dtype=str),
+                  'n_samples': np.array(self.n_samples_), 'mean': self.mean_, 'var': self.var_}
+        for i, cats in enumerate(self.categories_):
+            arrays['cat_%d' % i] = cats
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            transformer = cls([str(c) for c in data['numeric']], [str(c) for c in data['categories']])
+            transformer.n_samples_ = int(data['n_samples'])
+            transformer.mean_ = data['mean']
+            transformer.var_ = data['var']
+            transformer.categories_ = [data['cat_%d' % i] for i in range(len(transformer.categories))]
+        transformer._update_scale()
+        transformer._index_categories()
+        return transformer
@@ -1,48 +1,434 @@
 # Arda Mavi
 import os
+import json
+import time
+import hashlib
+import queue
+import threading
 import numpy as np
 from os import listdir
-from scipy.misc import imread, imresize
-from keras.utils import to_categorical
-from sklearn.model_selection import train_test_split
+from multiprocessing import Pool, cpu_count
+# PIL, scipy and sklearn are imported where they are used, so the batch
+# helpers (normalize_batch, one_hot, the cache readers) only need numpy
 
 # Settings:
 img_size = 64
 grayscale_images = True
 num_class = 10
+fast_decode = True # Let the JPEG decoder downscale (draft mode) instead of decoding full size
 test_size = 0.2
+num_workers = None # Processes decoding images, None uses every core
+chunk_size = 16 # Images sent to a worker at a time
+cache_path = 'npy_dataset'
+shard_size = 256 # Images per cache shard
+hash_files = False # Also compare file contents (sha1) when size or mtime changed
 
 def get_img(data_path):
+    if fast_decode:
+        return get_img_draft(data_path)
+    from scipy.misc import imread, imresize
     # Getting image array from path:
     img = imread(data_path, flatten=grayscale_images)
     img = imresize(img, (img_size, img_size, 1 if grayscale_images else 3))
     return img
 
-def get_dataset(dataset_path='Dataset'):
-    # Getting all data from data path:
+def get_img_draft(data_path):
+    # Getting image array from path, decoding the JPEG at 1/2, 1/4 or 1/8 of
+    # its size (the smallest still at least img_size) with the DCT scaling of
+    # the decoder, so most of the full size decode is never done:
+    from PIL import Image
+    mode = 'L' if grayscale_images else 'RGB'
+    img = Image.open(data_path)
+    img.draft(mode, (img_size, img_size))
+    img = img.convert(mode).resize((img_size, img_size), Image.BILINEAR)
+    if not grayscale_images:
+        return np.asarray(img, dtype='uint8')
+    img = np.asarray(img, dtype='float32')
+    # Stretch to the full 0-255 range, as imresize does with imread's float images
+    low, high = img.min(), img.max()
+    if high > low:
+        img -= low
+        img *= 255. / (high - low)
+    img += 0.5
+    return img.astype('uint8')
+
+def list_images(dataset_path='Dataset'):
+    # Getting the path and label of every image, one folder per label:
+    paths = []
+    labels = []
+    for label in sorted(listdir(dataset_path)):
+        datas_path = dataset_path+'/'+label
+        for data in sorted(listdir(datas_path)):
+            paths.append(datas_path+'/'+data)
+            labels.append(int(label))
+    return paths, labels
+
+def _set_decode_settings(settings):
+    # Pool initializer: with the spawn start method (Windows, macOS) workers
+    # import this module afresh and would not see settings changed by the caller
+    globals().update(settings)
+
+def decode_images(paths, workers=None, report_every=200):
+    # Decoding and resizing images in a process pool, returned in the order of paths:
+    workers = workers or num_workers or cpu_count()
+    X = []
+    start = time.time()
+    def report():
+        elapsed = time.time() - start
+        print('Decoded %d/%d images, %.1f images/sec' % (len(X), len(paths), len(X) / max(elapsed, 1e-9)))
+    if workers == 1:
+        results = map(get_img, paths)
+        pool = None
+    else:
+        settings = {'img_size': img_size, 'grayscale_images': grayscale_images, 'fast_decode': fast_decode}
+        pool = Pool(workers, initializer=_set_decode_settings, initargs=(settings,))
+        results = pool.imap(get_img, paths, chunk_size) # imap keeps the order of paths
     try:
-            X = np.load('npy_dataset/X.npy')
-            Y = np.load('npy_dataset/Y.npy')
-    except:
-        labels = listdir(dataset_path) # Geting labels
-        X = []
-        Y = []
-        for i, label in enumerate(labels):
-            datas_path = dataset_path+'/'+label
-        for data in listdir(datas_path):
-            img = get_img(datas_path+'/'+data)
+        for img in results:
             X.append(img)
-            Y.append(int(label))
-        # Create dateset:
-        X = 1-np.array(X).astype('float32')/255.
-        Y = np.array(Y).astype('float32')
-        Y = to_categorical(Y, num_class)
-        if not os.path.exists('npy_dataset/'):
-            os.makedirs('npy_dataset/')
-        np.save('npy_dataset/X.npy', X)
-        np.save('npy_dataset/Y.npy', Y)
-        X, X_test, Y, Y_test = train_test_split(X, Y, test_size=test_size, random_state=42)
-    return X, X_test, Y, Y_test
+            if len(X) % report_every == 0:
+                report()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    report()
+    return X
+
+class ShardedArray(object):
+    # Read only array over the memory mapped shards of the cache. Indexing
+    # copies out only the rows asked for, so a batch pages in just the images
+    # it touches and processes reading the same cache share the page cache.
+    def __init__(self, paths, shard_size):
+        self.shards = [np.load(path, mmap_mode='r') for path in paths]
+        self.shard_size = shard_size
+        self.shape = (sum(len(shard) for shard in self.shards),) + self.shards[0].shape[1:]
+        self.dtype = self.shards[0].dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _rows(self, index):
+        # Negative indices count from the end, as with numpy; out of range ones raise
+        if np.any((index >= len(self)) | (index < -len(self))):
+            raise IndexError('index out of range for %d rows' % len(self))
+        return np.where(index < 0, index + len(self), index)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            shard, row = divmod(int(self._rows(index)), self.shard_size)
+            return np.array(self.shards[shard][row])
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(len(self)))
+        index = np.asarray(index)
+        return self.take(index)
+
+    def take(self, index, out=None):
+        # Gathering the rows in index, into out if given:
+        index = np.asarray(index)
+        if index.dtype == bool:
+            if len(index) != len(self):
+                raise IndexError('boolean index of %d rows for %d rows' % (len(index), len(self)))
+            index = np.flatnonzero(index)
+        shard_of, rows = np.divmod(self._rows(index), self.shard_size)
+        if out is None:
+            out = np.empty((len(index),) + self.shape[1:], dtype=self.dtype)
+        for shard in np.unique(shard_of):
+            hit = shard_of == shard
+            out[hit] = self.shards[shard][rows[hit]]
+        return out
+
+def cache_settings():
+    # Preprocessing settings the cached tensors depend on:
+    return {'img_size': img_size, 'grayscale_images': grayscale_images, 'storage': 'uint8',
+            'decoder': 'draft' if fast_decode else 'full'}
+
+def normalize_batch(X, out=None):
+    # uint8 pixels to the 1 - X/255. float32 images, into out if given:
+    if out is None:
+        out = np.empty(np.shape(X), dtype='float32')
+    np.multiply(X, np.float32(-1/255.), out=out)
+    out += 1
+    return out
+
+def one_hot(Y, out=None):
+    # Integer class ids to one-hot float32 rows, into out if given:
+    Y = np.asarray(Y)
+    if out is None:
+        out = np.empty((len(Y), num_class), dtype='float32')
+    out.fill(0)
+    out[np.arange(len(Y)), Y] = 1
+    return out
+
+class BatchReader(object):
+    # Reads batches of the cache as normalized images and one-hot labels. The
+    # returned arrays are buffers reused by the next read: copy them to keep them.
+    def __init__(self, X, Y, batch_size):
+        self.X = X
+        self.Y = Y
+        self._raw = np.empty((batch_size,) + X.shape[1:], dtype='uint8')
+        self._X_out = np.empty((batch_size,) + X.shape[1:], dtype='float32')
+        self._Y_out = np.empty((batch_size, num_class), dtype='float32')
+
+    def read(self, index):
+        n = len(index)
+        raw = self.X.take(index, out=self._raw[:n])
+        return normalize_batch(raw, self._X_out[:n]), one_hot(self.Y[index], self._Y_out[:n])
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def scan_files(paths, labels):
+    # Manifest entries of the images: path, label, size and mtime
+    files = []
+    for path, label in zip(paths, labels):
+        stat = os.stat(path)
+        files.append({'path': path, 'label': label, 'size': stat.st_size, 'mtime': stat.st_mtime})
+    return files
+
+def _unchanged(old, new):
+    if old['size'] == new['size'] and old['mtime'] == new['mtime']:
+        if 'sha1' in old:
+            new['sha1'] = old['sha1']
+        return True
+    if hash_files and 'sha1' in old and old['size'] == new['size']:
+        new['sha1'] = _sha1(new['path'])
+        return new['sha1'] == old['sha1']
+    return False
+
+def _remove_unused(path, used):
+    # Files of older builds (and the X.npy/Y.npy of the single file cache),
+    # once the index no longer lists them. A process that still maps one
+    # keeps reading it; on Windows it can't be removed yet and is left for
+    # the next build to remove.
+    for name in listdir(path):
+        old = name.endswith('.npy') and (name[:2] in ('X_', 'Y_') or name in ('X.npy', 'Y.npy'))
+        if old and name not in used:
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+
+def write_cache(X, Y, path=cache_path, files=None):
+    # Saving X as shards of shard_size images, Y whole, and the index last.
+    # Every build writes new files and the index is swapped in with
+    # os.replace, so the files an index lists never change: processes that
+    # have them mapped are not affected, and a build that dies halfway leaves
+    # the previous cache as it was.
+    if not os.path.exists(path):
+        os.makedirs(path)
+    build = '%d_%s' % (time.time() * 1000, os.urandom(3).hex())
+    shards = []
+    for i, start in enumerate(range(0, len(X), shard_size)):
+        name = 'X_%s_%05d.npy' % (build, i)
+        np.save(os.path.join(path, name), X[start:start+shard_size])
+        shards.append(name)
+    labels = 'Y_%s.npy' % build
+    np.save(os.path.join(path, labels), Y)
+    index = {'shard_size': shard_size, 'shards': shards, 'labels': labels, 'shape': list(np.shape(X)),
+             'settings': cache_settings(), 'files': files or []}
+    with open(os.path.join(path, 'index.json.tmp'), 'w') as f:
+        json.dump(index, f)
+    os.replace(os.path.join(path, 'index.json.tmp'), os.path.join(path, 'index.json'))
+    _remove_unused(path, set(shards + [labels]))
+
+def read_index(path=cache_path):
+    with open(os.path.join(path, 'index.json')) as f:
+        return json.load(f)
+
+def open_cache(path=cache_path):
+    # Opening the cache without reading it: X is a ShardedArray, Y a memory map
+    index = read_index(path)
+    X = ShardedArray([os.path.join(path, name) for name in index['shards']], index['shard_size'])
+    Y = np.load(os.path.join(path, index.get('labels', 'Y.npy')), mmap_mode='r')
+    return X, Y
+
+def update_cache(dataset_path='Dataset', path=cache_path, workers=None):
+    # Bringing the cache in line with the images in dataset_path. Images whose
+    # path, size and mtime (or sha1, see hash_files) match the manifest are
+    # copied from the cache, only new or changed ones are decoded, removed ones
+    # are dropped. Changed settings rebuild everything. Returns True if the
+    # cache was rewritten.
+    paths, labels = list_images(dataset_path)
+    files = scan_files(paths, labels)
+    try:
+        index = read_index(path)
+    except (IOError, OSError, ValueError): # No cache yet, or an unreadable index
+        index = None
+    cached = {}
+    if index is not None and index.get('settings') == cache_settings():
+        cached = dict((info['path'], (row, info)) for row, info in enumerate(index.get('files', [])))
+    reuse_new, reuse_old, decode = [], [], []
+    for i, info in enumerate(files):
+        old = cached.get(info['path'])
+        if old is not None and _unchanged(old[1], info):
+            reuse_new.append(i)
+            reuse_old.append(old[0])
+        else:
+            decode.append(i)
+    if index is not None and not decode and reuse_old == list(range(len(index.get('files', [])))):
+        return False
+    print('Cache: %d images reused, %d to decode' % (len(reuse_new), len(decode)))
+    imgs = decode_images([files[i]['path'] for i in decode], workers) if decode else []
+    if hash_files:
+        for i in decode:
+            files[i]['sha1'] = _sha1(files[i]['path'])
+    # Create dateset: raw uint8 pixels and integer class ids
+    if reuse_old:
+        X_old, Y_old = open_cache(path)
+        X = np.empty((len(files),) + X_old.shape[1:], dtype='uint8')
+        X[reuse_new] = X_old[reuse_old]
+        del X_old, Y_old # Unmap the old shards so they can be removed
+    else:
+        X = np.empty((len(files),) + np.shape(imgs[0]), dtype='uint8')
+    if decode:
+        X[decode] = np.array(imgs, dtype='uint8')
+    Y = np.array(labels, dtype='int64')
+    write_cache(X, Y, path, files)
+    return True
+
+def _split_digest(index):
+    # The split depends on the images, their order and labels, and test_size
+    digest = hashlib.sha1(json.dumps([[info['path'], info['label']] for info in index['files']]).encode('utf-8'))
+    digest.update(repr(test_size).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_split(path=cache_path):
+    # Train and test row indices of the cache, stratified by class. Saved in
+    # split.npz with a digest of the manifest, and made again when it changes.
+    index = read_index(path)
+    digest = _split_digest(index)
+    split_path = os.path.join(path, 'split.npz')
+    if os.path.exists(split_path):
+        with np.load(split_path) as split:
+            if str(split['digest']) == digest:
+                return split['train'], split['test']
+    from sklearn.model_selection import train_test_split
+    Y = np.load(os.path.join(path, index.get('labels', 'Y.npy')), mmap_mode='r')
+    train, test = train_test_split(np.arange(len(Y)), stratify=np.asarray(Y), test_size=test_size,
+                                   random_state=42)
+    np.savez(split_path, train=train, test=test, digest=np.array(digest))
+    return train, test
+
+class DatasetView(object):
+    # Rows index of the cache, read in batches: nothing is copied until a batch
+    # is asked for.
+    def __init__(self, X, Y, index):
+        self.X = X
+        self.Y = Y
+        self.index = np.asarray(index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def batches(self, batch_size=32, shuffle=False):
+        # (X_batch, Y_batch) normalized and one-hot. The arrays are reused by
+        # the next batch (see BatchReader): copy them to keep them.
+        order = np.random.permutation(self.index) if shuffle else self.index
+        reader = BatchReader(self.X, self.Y, batch_size)
+        for start in range(0, len(order), batch_size):
+            yield reader.read(order[start:start+batch_size])
+
+    def load(self):
+        # The whole view as normalized images and one-hot labels
+        return normalize_batch(self.X.take(self.index)), one_hot(self.Y[self.index])
+
+def get_splits(dataset_path='Dataset', workers=None):
+    # Train and test DatasetViews over the memory mapped cache
+    if os.path.isdir(dataset_path):
+        update_cache(dataset_path, workers=workers)
+    X, Y = open_cache()
+    train, test = load_split()
+    return DatasetView(X, Y, train), DatasetView(X, Y, test)
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+class _Prefetched(object):
+    # Consumer side of prefetch. Closing it, or dropping it even before the
+    # first item, stops the producer thread.
+    def __init__(self, items, stop, end):
+        self._items = items
+        self._stop = stop
+        self._end = end
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._stop.is_set():
+            raise StopIteration
+        item = self._items.get()
+        if item is self._end:
+            self.close()
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self.close()
+            raise item.error
+        return item
+
+    def close(self):
+        self._stop.set()
+
+    def __del__(self):
+        self.close()
+
+def prefetch(iterable, size=4):
+    # Iterating over iterable in a background thread, at most size items ahead.
+    # Errors are raised in the consumer; closing or dropping the returned
+    # iterator stops the thread.
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    end = object()
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_Failure(e))
+        else:
+            put(end)
+    thread = threading.Thread(target=produce, name='prefetch')
+    thread.daemon = True
+    thread.start() # Starts filling the queue before the first batch is asked for
+    return _Prefetched(items, stop, end)
+
+def _stream_batches(paths, labels, batch_size):
+    for start in range(0, len(paths), batch_size):
+        X = np.array([get_img(path) for path in paths[start:start+batch_size]], dtype='uint8')
+        yield normalize_batch(X), one_hot(labels[start:start+batch_size])
+
+def iter_batches(dataset_path='Dataset', batch_size=32, shuffle=True, prefetch_batches=4):
+    # Streaming (X_batch, Y_batch) straight from the label folders, decoded in a
+    # background thread. Only prefetch_batches batches are held at a time, so
+    # memory follows the batch size rather than the dataset. One pass per call.
+    paths, labels = list_images(dataset_path)
+    if shuffle:
+        order = np.random.permutation(len(paths))
+        paths = [paths[i] for i in order]
+        labels = [labels[i] for i in order]
+    return prefetch(_stream_batches(paths, labels, batch_size), prefetch_batches)
+
+def get_dataset(dataset_path='Dataset', workers=None):
+    # Getting all data from data path, loaded in memory:
+    train, test = get_splits(dataset_path, workers)
+    X_train, Y_train = train.load()
+    X_test, Y_test = test.load()
+    return X_train, X_test, Y_train, Y_test
 
 if __name__ == '__main__':
-    get_dataset()
\ No newline at end of file
+    get_dataset()
@@ -3,22 +3,41 @@
 Created on Tue May 29 21:36:39 2018
 
 @author: rodel
+
+Importing this module has no side effects: tensorflow and pandas are only
+imported when first used. Run it as a script to train a model, see main() for
+the options.
 """
+import argparse
+import importlib
 import os
-path = 'C:/Users/rodel/Documents/Machine_Learning/'
-os.chdir(path)
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
 # Utility imports
 import numpy as np
 
+from features import FeatureTransformer
+from numpy_net import NumpyNet, compare_nets, quantize
+
+class _LazyModule(object):
+    """Stand-in for a heavy module that imports it on first attribute access."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
 # Data Managing imports
-import pandas as pd
+pd = _LazyModule('pandas')
 
 # Machine Learning imports
-import tensorflow as tf
-from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn_pandas import DataFrameMapper
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
+tf = _LazyModule('tensorflow')
 
 
 def _weight_variable(shape, name):
@@ -49,28 +68,121 @@ def _variable_summaries(var):
         tf.summary.scalar('min', tf.reduce_min(var))
         tf.summary.histogram('histogram', var)
 
-class Custom_Nnet(object): 
-    def __init__(self, layer_sizes, activations, learning_rate=1e-4, dropout=1, epochs=500):
+def _iterate_minibatches(X, y, batch_size, shuffle=True):
+    """Yield (X, y) batches of batch_size rows, in a new random order on every call."""
+    n = X.shape[0]
+    idx = np.random.permutation(n) if shuffle else np.arange(n)
+    for start in range(0, n, batch_size):
+        batch = idx[start:start+batch_size]
+        yield X[batch], y[batch]
+
+def csv_batches(path, transform, target='TS', batch_size=256, chunk_size=10000, shuffle=True):
+    """Return a generator function that streams (X, y) batches from a csv file.
+
+    Only chunk_size rows are held in memory at a time, so the file can be larger
+    than RAM. transform maps a DataFrame chunk to the feature matrix and rows are
+    shuffled within each chunk. Pass the result to Custom_Nnet.train as X.
+    """
+    def batches():
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            X_chunk = transform(chunk)
+            y_chunk = chunk[target].values.reshape([-1, 1])
+            for batch in _iterate_minibatches(X_chunk, y_chunk, batch_size, shuffle):
+                yield batch
+    return batches
+
+def _validation_split(X, y, fraction):
+    """Randomly hold out fraction of the rows; returns X, y, X_val, y_val."""
+    idx = np.random.permutation(X.shape[0])
+    n_val = int(round(X.shape[0] * fraction))
+    return X[idx[n_val:]], y[idx[n_val:]], X[idx[:n_val]], y[idx[:n_val]]
+
+def _save_layers_npz(path, weights, biases, activations, dtype='float32'):
+    arrays = {'activations': np.array(activations)}
+    for i, (w_fc, b_fc) in enumerate(zip(weights, biases)):
+        arrays['W_%d' % i], scale = quantize(w_fc, dtype)
+        if scale is not None:
+            arrays['W_scale_%d' % i] = scale
+        arrays['b_%d' % i] = b_fc
+    np.savez_compressed(path, **arrays)
+
+class _SummaryThread(threading.Thread):
+    """Write summaries to a FileWriter from a background thread.
+
+    The queue is bounded and add_summary never blocks: when TensorBoard falls
+    behind, summaries are dropped (and counted) instead of stalling training.
+    """
+    def __init__(self, writer, max_queue=10):
+        threading.Thread.__init__(self, name='summary_writer')
+        self.daemon = True
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.writer.add_summary(*item)
+        self.writer.close()
+
+    def add_summary(self, summary_str, step):
+        try:
+            self.queue.put_nowait((summary_str, step))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+class Custom_Nnet(object):
+    def __init__(self, layer_sizes, activations, learning_rate=1e-4, dropout=1, epochs=500,
+                 batch_size=None, shuffle=True, summary_steps=10, summary_secs=None,
+                 histograms=True, logdir='./graphs/n_net', ckpt_path='/tmp/model.ckpt',
+                 session_config=None, validation_split=0.0, patience=None, min_delta=0.0,
+                 resident=False, intra_op_threads=0, inter_op_threads=0, cpu_affinity=None):
         self.layer_sizes = layer_sizes
         self.activations = activations
         self.num_hidden = len(layer_sizes)
         self.learning_rate = learning_rate
         self.dropout = dropout
         self.epochs = epochs
-    
+        self.batch_size = batch_size # None trains on the full matrix every step
+        self.shuffle = shuffle
+        self.summary_steps = summary_steps # write summaries every n steps, 0 or None disables
+        self.summary_secs = summary_secs # if set, write summaries every n seconds instead
+        self.histograms = histograms # weight/activation histograms for TensorBoard
+        self.logdir = logdir
+        self.ckpt_path = ckpt_path
+        self.session_config = session_config # tf.ConfigProto for every session of this model
+        self.validation_split = validation_split # fraction of X held out when no X_val is given
+        self.patience = patience # epochs without improvement before stopping, None never stops
+        self.min_delta = min_delta # smallest drop in validation loss that counts as improvement
+        self.resident = resident # keep the training data in the graph instead of feeding it
+        self.intra_op_threads = intra_op_threads # threads inside one op (matmul), 0 lets tensorflow pick
+        self.inter_op_threads = inter_op_threads # ops run in parallel, 0 lets tensorflow pick
+        self.cpu_affinity = cpu_affinity # cpu ids the process is pinned to, where the OS supports it
+        self._profiler = None
+
     def _nn_layer(self, in_vals, out_size, layer_name, activation):
         with tf.name_scope('Layer_'+layer_name) as scope:
             in_size = in_vals.shape.as_list()[1]
             w_fc = _weight_variable([in_size, out_size], 'weight_input')   # weights
-            _variable_summaries(w_fc)
+            if self.histograms:
+                _variable_summaries(w_fc)
             b_fc = _bias_variable([out_size], 'bias_input')  # biases
+            self.weights.append(w_fc)
+            self.biases.append(b_fc)
             if layer_name == 'Output':
                 self.Y_hat = tf.matmul(in_vals, w_fc)+b_fc
                 return self.Y_hat
             elif layer_name == 'Hidden_1':
                 z = tf.matmul(in_vals, w_fc) + b_fc
                 h_fc1 = _activation(z, act_name = activation) # activation
-                tf.summary.histogram('activations_input', h_fc1)
+                if self.histograms:
+                    tf.summary.histogram('activations_input', h_fc1)
                 return h_fc1
             else:
                 z = tf.matmul(in_vals, w_fc) + b_fc
@@ -78,13 +190,48 @@ class Custom_Nnet(object):
                 h_fc1_drop = tf.nn.dropout(h_fc1, self.keep_prob, name='Dropout_'+ layer_name)
                 return h_fc1_drop
 
+    def _resident_inputs(self, x_width):
+        '''
+        Returns X, y batches gathered on graph from local variables that train
+        loads once, so the optimizer steps feed no data at all
+        '''
+        with tf.name_scope('resident_data') as scope:
+            self._X_data = tf.placeholder(tf.float32, [None, x_width], name='X_data')
+            self._y_data = tf.placeholder(tf.float32, [None, 1], name='y_data')
+            self._n_rows = tf.placeholder(tf.int64, [], name='n_rows')
+            # Local variables are left out of the checkpoint and the global initializer
+            X_var = tf.Variable(self._X_data, trainable=False, validate_shape=False,
+                                collections=[tf.GraphKeys.LOCAL_VARIABLES], name='X_resident')
+            y_var = tf.Variable(self._y_data, trainable=False, validate_shape=False,
+                                collections=[tf.GraphKeys.LOCAL_VARIABLES], name='y_resident')
+            # Only the row indices go through tf.data, the rows stay in one copy
+            idx = tf.data.Dataset.range(self._n_rows)
+            if self.shuffle and self.batch_size is not None:
+                idx = idx.shuffle(self._n_rows)
+            idx = idx.batch(self.batch_size or self._n_rows).repeat()
+            batch_iter = idx.make_initializable_iterator()
+            batch_idx = batch_iter.get_next()
+            self._data_init = [X_var.initializer, y_var.initializer, batch_iter.initializer]
+            X_batch = tf.reshape(tf.gather(X_var, batch_idx), [-1, x_width])
+            y_batch = tf.reshape(tf.gather(y_var, batch_idx), [-1, 1])
+        return X_batch, y_batch
+
     def _build_network(self,x_width):
+        if self.resident:
+            X_batch, y_batch = self._resident_inputs(x_width)
         ### Placeholders ###
         with tf.name_scope('placeholder') as scope:
-            self.y = tf.placeholder(tf.float32, [None, 1], name='y')
-            self.X = tf.placeholder(tf.float32, [None, x_width], name='X') # Placeholder values
+            if self.resident:
+                # Feeding X (validation, predict) still overrides the resident batch
+                self.y = tf.placeholder_with_default(y_batch, [None, 1], name='y')
+                self.X = tf.placeholder_with_default(X_batch, [None, x_width], name='X')
+            else:
+                self.y = tf.placeholder(tf.float32, [None, 1], name='y')
+                self.X = tf.placeholder(tf.float32, [None, x_width], name='X') # Placeholder values
             self.keep_prob = tf.placeholder("float", name='keep_prob') # Placeholder values
 
+        self.weights = []
+        self.biases = []
         output = self.X
         output_size = 1
         for i, size in enumerate(self.layer_sizes + [output_size]):
@@ -103,87 +250,469 @@ class Custom_Nnet(object):
     
     def _optimizer(self):
         with tf.name_scope("train") as scope:
-            self.optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate).minimize(self._loss())
+            self.loss = self._loss()
+            self.optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate).minimize(self.loss)
     
-    def build_graph(self,x_with):
+    def build_graph(self,x_width):
         with tf.Graph().as_default() as g:  
             self._build_network(x_width)
             self._optimizer()
             ### Write Summary Out ###
             self.merged = tf.summary.merge_all()
             self.g = g
-            self.saver = tf.train.Saver()
+            self.saver = tf.train.Saver(max_to_keep=1)
+
+    def _session(self):
+        '''
+        Opens a session on the model graph with the configured thread pools.
+        The CPU affinity applies to the whole process
+        '''
+        if self.cpu_affinity is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpu_affinity)
+        config = self.session_config
+        if self.intra_op_threads or self.inter_op_threads:
+            config = tf.ConfigProto()
+            if self.session_config is not None:
+                config.CopyFrom(self.session_config)
+            config.intra_op_parallelism_threads = self.intra_op_threads
+            config.inter_op_parallelism_threads = self.inter_op_threads
+        return tf.Session(graph=self.g, config=config)
+
+    def _epoch_batches(self, X, y):
+        if callable(X):
+            return X() # generator function, one fresh pass over the data per epoch
+        if self.batch_size is None:
+            return [(X, y)]
+        return _iterate_minibatches(X, y, self.batch_size, self.shuffle)
+
+    def _epoch_feeds(self, X, y):
+        if self.resident:
+            for _ in range(self._steps_per_epoch):
+                yield {self.keep_prob: self.dropout}
+        else:
+            for X_batch, y_batch in self._epoch_batches(X, y):
+                yield {self.X: X_batch, self.y: y_batch, self.keep_prob: self.dropout}
+
+    def _load_resident(self, sess, X, y):
+        if callable(X):
+            raise ValueError('resident training needs X and y as arrays, not a generator')
+        # Converted to contiguous float32 and copied into the runtime once per train call
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        y = np.ascontiguousarray(y, dtype=np.float32)
+        sess.run(self._data_init, feed_dict={self._X_data: X, self._y_data: y, self._n_rows: X.shape[0]})
+        self._resident_rows = self.batch_size or X.shape[0]
+        self._steps_per_epoch = (X.shape[0] + self._resident_rows - 1) // self._resident_rows
+
+    def _summary_due(self, step, last_summary):
+        if self.summary_secs is not None:
+            return time.time() - last_summary >= self.summary_secs
+        return step % self.summary_steps == 0
+
+    def _save(self, sess):
+        start = time.time()
+        self.saver.save(sess, self.ckpt_path)
+        if self._profiler is not None:
+            self._profiler.record('checkpoint', time.time() - start)
+
+    def _validate(self, sess, X_val, y_val, epoch):
+        '''
+        Saves a checkpoint when the validation loss improves on the best so far,
+        and always on the first validation (or while the best is NaN or inf)
+        so ckpt_path never keeps the weights of an older run.
+        Returns True once it has not improved for patience epochs
+        '''
+        start = time.time()
+        val_loss = sess.run(self.loss, feed_dict={self.X: X_val, self.y: y_val, self.keep_prob: 1})
+        if self._profiler is not None:
+            self._profiler.record('validation', time.time() - start, epoch=epoch, loss=float(val_loss))
+        if (self.best_epoch is None or not np.isfinite(self.best_val_loss)
+                or val_loss < self.best_val_loss - self.min_delta):
+            self.best_val_loss = val_loss
+            self.best_epoch = epoch
+            self._save(sess)
+        return self.patience is not None and epoch - self.best_epoch >= self.patience
 
 #   TODO: Get display working
-    def train(self,X,y):
-        with tf.Session(graph=self.g) as sess:            
-            sess.run(tf.global_variables_initializer())
-            summary_writer = tf.summary.FileWriter('./graphs/n_net', graph=sess.graph)
-            for epoch in range(self.epochs): # Train for 3000 epochs
-                sess.run(self.optimizer, feed_dict={self.X: X, self.y: y,
-                                                    self.keep_prob: self.dropout}) # run GD
-                if epoch % 10 == 0:
-                    print("Epoch:", '%04d' % (epoch+1))
-                # Write logs for each iteration
-                summary_str = sess.run(self.merged, feed_dict={self.X: X, self.y:y, self.keep_prob: 1})
-                summary_writer.add_summary(summary_str, epoch)
-                # Run the code below in the console
-                #tensorboard --logdir=C:/Users/rodel/Documents/Machine_Learning/graphs/n_net --host=127.0.0.1
-                #tensorboard --inspect --logdir C:/Users/rodel/Documents/Machine_Learning/graphs/n_net
+    def train(self,X,y=None,X_val=None,y_val=None,epochs=None,warm_start=False,profiler=None):
+        '''
+        X and y are the full training arrays, or X is a generator function
+        (e.g. from csv_batches) returning an iterator of (X, y) batches and y is None.
+        With a validation set (X_val, y_val or validation_split) the checkpoint
+        holds the weights of the epoch with the lowest validation loss, and
+        training stops early once it has not improved for patience epochs.
+        epochs overrides self.epochs for this call and warm_start continues
+        from the weights in ckpt_path instead of a random initialization.
+        profiler is an optional profiler.TrainingProfiler
+        '''
+        epochs = self.epochs if epochs is None else epochs
+        self._profiler = profiler
+        if X_val is None and self.validation_split and not callable(X):
+            X, y, X_val, y_val = _validation_split(X, y, self.validation_split)
+        self.best_val_loss = np.inf
+        self.best_epoch = None
+        with self._session() as sess:
+            if warm_start:
+                self.saver.restore(sess, self.ckpt_path)
+            else:
+                sess.run(tf.global_variables_initializer())
+            if self.resident:
+                self._load_resident(sess, X, y)
+            summary_writer = None
+            if self.summary_steps or self.summary_secs is not None:
+                summary_writer = _SummaryThread(tf.summary.FileWriter(self.logdir, graph=sess.graph))
+                summary_writer.start()
+            # Run the code below in the console
+            #tensorboard --logdir=C:/Users/rodel/Documents/Machine_Learning/graphs/n_net --host=127.0.0.1
+            #tensorboard --inspect --logdir C:/Users/rodel/Documents/Machine_Learning/graphs/n_net
+            step = 0
+            last_summary = time.time()
+            try:
+                for epoch in range(epochs): # Train for 3000 epochs
+                    for feed in self._epoch_feeds(X, y):
+                        run_args = profiler.run_args(step) if profiler is not None else {}
+                        start = time.time()
+                        if summary_writer is not None and self._summary_due(step, last_summary):
+                            # Summaries come out of the same forward pass as the GD step
+                            _, summary_str = sess.run([self.optimizer, self.merged], feed_dict=feed, **run_args)
+                            summary_writer.add_summary(summary_str, step)
+                            last_summary = time.time()
+                            kind = 'summary'
+                        else:
+                            sess.run(self.optimizer, feed_dict=feed, **run_args) # run GD
+                            kind = 'optimizer'
+                        if profiler is not None:
+                            rows = feed[self.X].shape[0] if self.X in feed else self._resident_rows
+                            profiler.record_step(step, kind, time.time() - start, rows, run_args)
+                        step += 1
+                    if epoch % 10 == 0:
+                        print("Epoch:", '%04d' % (epoch+1))
+                    if X_val is not None and self._validate(sess, X_val, y_val, epoch):
+                        print("Early stopping at epoch", epoch+1, "best validation loss", self.best_val_loss)
+                        break
+            finally:
+                if summary_writer is not None:
+                    summary_writer.close()
             print("Optimization Finished!")
-            self.saver.save(sess, "/tmp/model.ckpt")
+            if X_val is None or self.best_epoch is None: # e.g. epochs=0: nothing was validated
+                self._save(sess)
 
     
+    def partial_fit(self, X_new, y_new, X_old=None, y_old=None, replay=1.0, epochs=10, **train_args):
+        '''
+        Continues training from the last checkpoint for a bounded number of
+        epochs on the new rows plus a random replay sample of
+        replay * len(X_new) old rows, so the cost follows the size of the
+        update rather than the whole history. Old and new rows must come from
+        the same (updated) FeatureTransformer
+        '''
+        if X_old is not None and replay:
+            n_replay = min(X_old.shape[0], int(round(replay * X_new.shape[0])))
+            idx = np.random.choice(X_old.shape[0], n_replay, replace=False)
+            X_new = np.vstack([X_new, X_old[idx]])
+            y_new = np.vstack([y_new, y_old[idx]])
+        self.train(X_new, y_new, epochs=epochs, warm_start=True, **train_args)
+
     def predict(self,X):
-        y_fake = np.ones((X.shape[0],1))
-        with tf.Session(graph=self.g) as sess:
-            self.saver.restore(sess, "/tmp/model.ckpt")            
+        with self._session() as sess:
+            self.saver.restore(sess, self.ckpt_path)
             # Evaluate the predicted values
-            yP = sess.run(self.Y_hat, feed_dict={self.X: X, self.y: y_fake, self.keep_prob:1})
+            yP = sess.run(self.Y_hat, feed_dict={self.X: X, self.keep_prob:1})
             return yP
+
+    def _layer_arrays(self, ckpt_path=None):
+        with self._session() as sess:
+            self.saver.restore(sess, ckpt_path or self.ckpt_path)
+            return sess.run([self.weights, self.biases])
+
+    def export_npz(self, path, ckpt_path=None, dtype='float32'):
+        '''
+        Saves the trained weights, biases and hidden activations to a compressed
+        .npz file that numpy_net.NumpyNet can score without importing tensorflow.
+        dtype 'float16' or 'int8' stores compact weights (see numpy_net.quantize)
+        '''
+        weights, biases = self._layer_arrays(ckpt_path)
+        _save_layers_npz(path, weights, biases, self.activations[:self.num_hidden], dtype)
+
+class Ensemble_Nnet(Custom_Nnet):
+    '''
+    n_members copies of the same architecture, each with its own random
+    initialization, trained together in one graph. Every layer keeps the
+    weights of all the members stacked in one [n_members, in, out] tensor and
+    runs one batched matmul, so a training step is a single sess.run for the
+    whole ensemble. The loss is the sum of the member losses, which leaves
+    each member's gradient the same as if it were trained alone
+    '''
+    def __init__(self, layer_sizes, activations, n_members=10, **kwargs):
+        Custom_Nnet.__init__(self, layer_sizes, activations, **kwargs)
+        self.n_members = n_members
+
+    def _nn_layer(self, in_vals, out_size, layer_name, activation):
+        with tf.name_scope('Layer_'+layer_name) as scope:
+            if in_vals.shape.ndims == 2:
+                # Network input, shared by all the members
+                in_vals = tf.tile(tf.expand_dims(in_vals, 0), [self.n_members, 1, 1])
+            in_size = in_vals.shape.as_list()[2]
+            w_fc = _weight_variable([self.n_members, in_size, out_size], 'weight_input')   # weights
+            if self.histograms:
+                _variable_summaries(w_fc)
+            b_fc = _bias_variable([self.n_members, 1, out_size], 'bias_input')  # biases
+            self.weights.append(w_fc)
+            self.biases.append(b_fc)
+            z = tf.matmul(in_vals, w_fc) + b_fc
+            if layer_name == 'Output':
+                self.Y_hat = z # [n_members, rows, 1]
+                return self.Y_hat
+            h_fc1 = _activation(z, act_name = activation) # activation
+            if layer_name == 'Hidden_1':
+                if self.histograms:
+                    tf.summary.histogram('activations_input', h_fc1)
+                return h_fc1
+            return tf.nn.dropout(h_fc1, self.keep_prob, name='Dropout_'+ layer_name)
+
+    def predict_members(self, X):
+        return Custom_Nnet.predict(self, X)
+
+    def predict(self, X):
+        '''Returns the mean and the standard deviation of the member predictions'''
+        yP = self.predict_members(X)
+        return yP.mean(axis=0), yP.std(axis=0)
+
+    def export_npz(self, path, ckpt_path=None, dtype='float32', member=0):
+        '''Exports one member of the ensemble for numpy_net.NumpyNet'''
+        weights, biases = self._layer_arrays(ckpt_path)
+        _save_layers_npz(path, [w_fc[member] for w_fc in weights], [b_fc[member, 0] for b_fc in biases],
+                         self.activations[:self.num_hidden], dtype)
+
+class Nnet_Predictor(object):
+    """Keep a trained Custom_Nnet restored in a resident session for repeated scoring.
+
+    The checkpoint is read once, on construction, instead of on every call.
+    For an Ensemble_Nnet predict_batch returns the mean and the standard
+    deviation of the members, as Ensemble_Nnet.predict does.
+    """
+    def __init__(self, nnet, ckpt_path=None):
+        self.nnet = nnet
+        self.sess = nnet._session()
+        nnet.saver.restore(self.sess, ckpt_path or nnet.ckpt_path)
+        self._lock = threading.Lock()
+
+    def predict_batch(self, X):
+        # One run at a time, so callers on several threads can share the session
+        with self._lock:
+            yP = self.sess.run(self.nnet.Y_hat, feed_dict={self.nnet.X: X, self.nnet.keep_prob: 1})
+        if isinstance(self.nnet, Ensemble_Nnet):
+            return yP.mean(axis=0), yP.std(axis=0)
+        return yP
+
+    def close(self):
+        self.sess.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class MicroBatcher(object):
+    """Merge concurrent small predict requests into one sess.run.
+
+    The first request waiting in the queue is held for at most max_latency
+    seconds while more requests arrive; the merged batch (up to max_batch rows)
+    is scored with a single predict_batch call and the rows are handed back to
+    each caller through a Future.
+    """
+    def __init__(self, predictor, max_batch=256, max_latency=0.005):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._requests = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._serve, name='micro_batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, X):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('MicroBatcher is closed')
+            self._requests.put((np.atleast_2d(X), future))
+        return future
+
+    def predict(self, X):
+        return self.submit(X).result()
+
+    def _collect(self):
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = first[0].shape[0]
+        deadline = time.time() + self.max_latency
+        while rows < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._requests.put(None) # finish this batch, then stop
+                break
+            batch.append(item)
+            rows += item[0].shape[0]
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            try:
+                yP = self.predictor.predict_batch(np.vstack([X for X, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for X, future in batch:
+                stop = start + X.shape[0]
+                if isinstance(yP, tuple): # ensemble mean and std
+                    future.set_result(tuple(part[start:stop] for part in yP))
+                else:
+                    future.set_result(yP[start:stop])
+                start = stop
+        # Fail whatever is still queued, so no caller waits forever
+        while True:
+            try:
+                item = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError('MicroBatcher is closed'))
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._requests.put(None)
+        self._thread.join()
     
+def load_data(data_path):
+    # Read the raw data file into arrays
+    data = pd.read_csv(data_path)
+    return data[['Season','M3','TH','Este','Norte','TS']]
+
+def build_features(data):
+    '''
+    Returns the fitted FeatureTransformer, the float32 feature matrix and the
+    target column of data
+    '''
+    # 1) Create a transformer to take care of all transformations
+    numeric = ['M3','TH','Este','Norte']
+    categories = ['Season']
+    transformer = FeatureTransformer(numeric, categories)
+    # 2) build the dataset
+    data_ = transformer.fit_transform(data)
+    y = data.TS.values.reshape([len(data.TS),1])
+    return transformer, data_, y
+
 ##############################################################
 ########               Model Start                 ###########
 ##############################################################
-# Read the raw data file into arrays
-dataPath ='C:/Users/rodel/Dropbox/Pmena EAcuna Rdelafu/Latex/Base.csv'
-save_dir = 'C:/Users/rodel/Documents/Machine_Learning/imagenes/'
-
-data = pd.read_csv(dataPath)
-data=data[['Season','M3','TH','Este','Norte','TS']]
-###############################################
-####  Neural Network with Tensor Flow    ######
-###############################################
-# 1) Create a mapper to take care of all transformations
-numeric = ['M3','TH','Este','Norte']
-categories = ['Season']
-data_cat_encoded, data_categories = data["Season"].factorize()
-data.Season = data_cat_encoded
-# Define a dummy encoder
-
-class DummyEncoder(BaseEstimator, TransformerMixin):
-    def __init__(self, n_values='auto'):
-        self.n_values = n_values
-        self.ohe = OneHotEncoder(sparse=False, n_values=self.n_values)
-    def transform(self, X, train=True):
-            return self.ohe.transform(X)[:,:-1]
-    def fit(self, X, y=None, **fit_params):
-        return self.ohe.fit(X)
-  
-mapper = DataFrameMapper([(numeric, StandardScaler()),
-                          (categories, DummyEncoder())])
-# 2) Define the parameters to pass into the neural network
-# 3) build the dataset
-mapper.fit(data.copy())
-data_ = np.round(mapper.transform(data.copy()), 2)
-rows, cols = data_.shape
-hidden = [10,10]
-act = ['ReLU' for _ in range(len(hidden))]
-nn=Custom_Nnet(hidden,act)
-x_width = data_.shape[1]
-nn.build_graph(x_width)
-y = data.TS.values.reshape([len(data.TS),1])
-nn.train(data_,y)
-Y_hat=nn.predict(data_)
-
-np.hstack([y,Y_hat])
\ No newline at end of file
+def main(argv=None):
+    default_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'Base.csv')
+    parser = argparse.ArgumentParser(description='Train a Custom_Nnet on Base.csv to predict TS')
+    parser.add_argument('--data', default=default_data, help='path to Base.csv')
+    parser.add_argument('--hidden', type=int, nargs='+', default=[10, 10], help='hidden layer sizes')
+    parser.add_argument('--activations', nargs='+', default=None,
+                        help='one of ReLU, Tanh or Sigmoid per hidden layer (default ReLU)')
+    parser.add_argument('--epochs', type=int, default=500)
+    parser.add_argument('--members', type=int, default=1,
+                        help='train an ensemble of this many independently initialized nets in one graph')
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--dropout', type=float, default=1, help='keep probability')
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--logdir', default='./graphs/n_net')
+    parser.add_argument('--ckpt', default='/tmp/model.ckpt')
+    parser.add_argument('--resident', action='store_true',
+                        help='load the training data into the graph once instead of feeding it every step')
+    parser.add_argument('--intra-op-threads', type=int, default=0)
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    parser.add_argument('--profile', default=None, help='append per step profiling records to this JSONL file')
+    parser.add_argument('--trace-steps', type=int, nargs='+', default=[],
+                        help='steps to dump as Chrome traces (needs --profile)')
+    parser.add_argument('--export', default=None, help='export the trained weights to this .npz for numpy_net')
+    parser.add_argument('--export-dtype', default='float32', choices=['float32', 'float16', 'int8'])
+    parser.add_argument('--features', default=None,
+                        help='FeatureTransformer file, saved after fitting and updated with --new-data')
+    parser.add_argument('--new-data', default=None,
+                        help='csv of newly appended rows: warm start from --ckpt on them instead of training from scratch')
+    parser.add_argument('--replay', type=float, default=1.0,
+                        help='old rows replayed with --new-data, as a fraction of the new rows')
+    parser.add_argument('--validation-split', type=float, default=0.0)
+    parser.add_argument('--patience', type=int, default=None)
+    parser.add_argument('--min-delta', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    ###############################################
+    ####  Neural Network with Tensor Flow    ######
+    ###############################################
+    data = load_data(args.data)
+    if args.new_data:
+        if not args.features:
+            parser.error('--new-data needs the --features file of the model being updated')
+        new = load_data(args.new_data)
+        transformer = FeatureTransformer.load(args.features).partial_fit(new)
+        data_, y = transformer.transform(data), data.TS.values.reshape([len(data.TS),1])
+    else:
+        transformer, data_, y = build_features(data)
+    # Define the parameters to pass into the neural network
+    hidden = args.hidden
+    act = args.activations or ['ReLU' for _ in range(len(hidden))]
+    model_class, kwargs = Custom_Nnet, {}
+    if args.members > 1:
+        model_class, kwargs = Ensemble_Nnet, {'n_members': args.members}
+    nn=model_class(hidden, act, learning_rate=args.learning_rate, dropout=args.dropout,
+                   epochs=args.epochs, batch_size=args.batch_size, logdir=args.logdir,
+                   ckpt_path=args.ckpt, validation_split=args.validation_split,
+                   patience=args.patience, min_delta=args.min_delta, resident=args.resident,
+                   intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads,
+                   **kwargs)
+    x_width = data_.shape[1]
+    nn.build_graph(x_width)
+    profiler = None
+    if args.profile:
+        from profiler import TrainingProfiler
+        profiler = TrainingProfiler(args.profile, trace_steps=args.trace_steps)
+    if args.new_data:
+        y_new = new.TS.values.reshape([len(new.TS),1])
+        nn.partial_fit(transformer.transform(new), y_new, data_, y, replay=args.replay, epochs=args.epochs,
+                       profiler=profiler)
+    else:
+        nn.train(data_,y,profiler=profiler)
+    if args.features:
+        # Saved once training succeeded, so a failed --new-data run can be rerun
+        # without counting the new rows twice
+        transformer.save(args.features)
+    if profiler is not None:
+        profiler.close()
+        print(profiler.summary())
+    if args.export:
+        nn.export_npz(args.export, dtype=args.export_dtype)
+        if args.export_dtype != 'float32' and args.members == 1:
+            weights, biases = nn._layer_arrays()
+            reference = NumpyNet(weights, biases, act)
+            print('Accuracy of the compact weights:', compare_nets(reference, NumpyNet.load(args.export), data_))
+    Y_hat=nn.predict(data_)
+    if args.members > 1:
+        Y_hat, Y_std = Y_hat
+        print(np.hstack([y,Y_hat,Y_std]))
+    else:
+        print(np.hstack([y,Y_hat]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy forward pass for networks exported with Custom_Nnet.export_npz.
+
+Scoring with NumpyNet does not import tensorflow. Weights can be exported as
+float16 or as int8 with one scale per layer, which keeps 2x or 4x more models
+resident in the same memory; compare_nets reports what that costs in accuracy.
+"""
+import numpy as np
+
+
+def _activation(z_val, act_name='ReLU'):
+    # In place version of neural_net._activation
+    if act_name == "ReLU":
+        np.maximum(z_val, 0, out=z_val)
+    elif act_name == "Tanh":
+        np.tanh(z_val, out=z_val)
+    else:
+        with np.errstate(over='ignore'):
+            np.negative(z_val, out=z_val)
+            np.exp(z_val, out=z_val)
+        z_val += 1
+        np.reciprocal(z_val, out=z_val)
+    return z_val
+
+def quantize(w_fc, dtype):
+    '''
+    Returns the compact copy of the weight matrix w_fc and its scale: float16
+    needs no scale (None), int8 uses one symmetric scale for the whole layer
+    '''
+    dtype = np.dtype(dtype)
+    if dtype == np.float32:
+        return w_fc.astype(np.float32), None
+    if dtype == np.float16:
+        return w_fc.astype(np.float16), None
+    if dtype == np.int8:
+        scale = float(np.abs(w_fc).max()) / 127. or 1.
+        return np.round(w_fc / scale).astype(np.int8), np.float32(scale)
+    raise ValueError('Weights can be stored as float32, float16 or int8, not %s' % dtype)
+
+def compare_nets(reference, compact, X):
+    '''
+    Accuracy and memory of a compact (float16/int8) NumpyNet against the
+    float32 reference on the rows of X, as a dict
+    '''
+    y_ref = reference.predict(X)
+    diff = compact.predict(X) - y_ref
+    return {'max_abs_diff': float(np.abs(diff).max()),
+            'rmse': float(np.sqrt(np.mean(diff ** 2))),
+            'rmse_relative': float(np.sqrt(np.mean(diff ** 2)) / (np.sqrt(np.mean(y_ref ** 2)) or 1.)),
+            'weight_bytes': compact.weight_bytes, 'reference_weight_bytes': reference.weight_bytes}
+
+class NumpyNet(object):
+    """Score an exported Custom_Nnet with preallocated per-layer buffers.
+
+    Inputs are processed in chunks of at most max_batch rows. Each layer writes
+    into its own buffer and the activation runs in place, so predict allocates
+    nothing when out is given. The buffers are shared state: use one NumpyNet
+    per thread.
+
+    float16 and int8 weights (see quantize) stay compact in memory; each layer
+    is widened into one scratch buffer, the size of the largest layer, right
+    before its matmul, and int8 outputs are multiplied by the layer scale.
+    """
+    def __init__(self, weights, biases, activations, max_batch=1024, dtype=np.float32, scales=None):
+        self.dtype = np.dtype(dtype)
+        self.weights = [np.ascontiguousarray(w) if w.dtype in (np.float16, np.int8)
+                        else np.ascontiguousarray(w, dtype=self.dtype) for w in weights]
+        self.scales = list(scales) if scales is not None else [None] * len(self.weights)
+        self.biases = [np.ascontiguousarray(b, dtype=self.dtype) for b in biases]
+        self.activations = list(activations) + [None] # the output layer is linear
+        self.max_batch = max_batch
+        self._input = np.empty((max_batch, self.weights[0].shape[0]), dtype=self.dtype)
+        self._buffers = [np.empty((max_batch, w.shape[1]), dtype=self.dtype) for w in self.weights]
+        compact = [w.size for w in self.weights if w.dtype != self.dtype]
+        self._scratch = np.empty(max(compact), dtype=self.dtype) if compact else None
+
+    @property
+    def weight_bytes(self):
+        return sum(w.nbytes for w in self.weights) + sum(b.nbytes for b in self.biases)
+
+    @classmethod
+    def load(cls, path, max_batch=1024):
+        with np.load(path) as data:
+            n_layers = len([k for k in data.files if k.startswith('b_')])
+            weights = [data['W_%d' % i] for i in range(n_layers)]
+            biases = [data['b_%d' % i] for i in range(n_layers)]
+            activations = [str(a) for a in data['activations']]
+            scales = [data['W_scale_%d' % i] if 'W_scale_%d' % i in data.files else None
+                      for i in range(n_layers)]
+        return cls(weights, biases, activations, max_batch=max_batch, scales=scales)
+
+    def _forward(self, X_chunk):
+        rows = X_chunk.shape[0]
+        if X_chunk.dtype != self.dtype:
+            h = self._input[:rows]
+            h[...] = X_chunk
+        else:
+            h = X_chunk
+        for w_fc, scale, b_fc, act_name, buf in zip(self.weights, self.scales, self.biases,
+                                                    self.activations, self._buffers):
+            z = buf[:rows]
+            if w_fc.dtype != self.dtype:
+                w_wide = self._scratch[:w_fc.size].reshape(w_fc.shape)
+                np.copyto(w_wide, w_fc, casting='unsafe')
+                w_fc = w_wide
+            np.dot(h, w_fc, out=z)
+            if scale is not None:
+                z *= scale
+            z += b_fc
+            if act_name is not None:
+                _activation(z, act_name)
+            h = z
+        return h
+
+    def predict(self, X, out=None):
+        X = np.asarray(X)
+        if out is None:
+            out = np.empty((X.shape[0], self.weights[-1].shape[1]), dtype=self.dtype)
+        for start in range(0, X.shape[0], self.max_batch):
+            stop = min(start + self.max_batch, X.shape[0])
+            out[start:stop] = self._forward(X[start:stop])
+        return out
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling for Custom_Nnet.train.
+
+Pass a TrainingProfiler to train to record, for every step, its wall time,
+examples/sec, the peak RSS of the process and whether the sess.run was a
+plain optimizer step or also fetched summaries. Validation and checkpoint
+save times are recorded as well. The records are kept in memory (see
+summary) and can be appended to a JSONL file as they happen; chosen steps can
+also be dumped as a Chrome trace (chrome://tracing) of the tensorflow ops.
+"""
+import json
+import os
+import sys
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+from neural_net import tf
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024. ** 2 if sys.platform == 'darwin' else peak / 1024.
+
+class TrainingProfiler(object):
+    def __init__(self, jsonl_path=None, trace_steps=(), trace_dir='./traces'):
+        self.trace_steps = set(trace_steps)
+        self.trace_dir = trace_dir
+        self.records = []
+        self.totals = {'optimizer': 0.0, 'summary': 0.0, 'validation': 0.0, 'checkpoint': 0.0}
+        self._jsonl = open(jsonl_path, 'a') if jsonl_path else None
+
+    def run_args(self, step):
+        '''
+        Returns the options and run_metadata keyword arguments for the
+        sess.run of step: a full trace for the chosen steps, nothing otherwise
+        '''
+        if step not in self.trace_steps:
+            return {}
+        return {'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                'run_metadata': tf.RunMetadata()}
+
+    def _write(self, record):
+        self.records.append(record)
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(record) + '\n')
+
+    def record_step(self, step, kind, seconds, examples, run_args=None):
+        '''kind is 'optimizer' or 'summary' (optimizer step that also fetched summaries)'''
+        self.totals[kind] += seconds
+        record = {'event': 'step', 'step': step, 'kind': kind, 'seconds': seconds,
+                  'examples': examples, 'examples_per_sec': examples / seconds if seconds else None,
+                  'peak_rss_mb': _peak_rss_mb()}
+        if run_args:
+            record['trace'] = self._write_trace(step, run_args['run_metadata'])
+        self._write(record)
+
+    def record(self, kind, seconds, **info):
+        '''Records a 'validation' or 'checkpoint' event'''
+        self.totals[kind] += seconds
+        record = {'event': kind, 'seconds': seconds, 'peak_rss_mb': _peak_rss_mb()}
+        record.update(info)
+        self._write(record)
+
+    def _write_trace(self, step, run_metadata):
+        from tensorflow.python.client import timeline
+        if not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+        path = os.path.join(self.trace_dir, 'step_%06d.json' % step)
+        with open(path, 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        return path
+
+    def summary(self):
+        '''Totals and throughput over all the recorded steps, as a dict'''
+        steps = [r for r in self.records if r['event'] == 'step']
+        step_time = sum(r['seconds'] for r in steps)
+        examples = sum(r['examples'] for r in steps)
+        return {'steps': len(steps), 'step_seconds': step_time, 'examples': examples,
+                'examples_per_sec': examples / step_time if step_time else None,
+                'peak_rss_mb': _peak_rss_mb(), 'seconds_by_kind': dict(self.totals)}
+
+    def close(self):
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
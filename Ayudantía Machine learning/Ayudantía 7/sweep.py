@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Hyperparameter sweep for Custom_Nnet.
+
+Every configuration is built with Custom_Nnet.build_graph and trained in a
+worker process from a pool, with tensorflow limited to its share of the cores.
+Results are appended to a csv as each run finishes; running the sweep again
+with the same results file skips the configurations already in it.
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from neural_net import Custom_Nnet, build_features, load_data
+
+FIELDS = ['config', 'final_loss', 'wall_time', 'examples_per_sec']
+
+# Per worker state, set once by _init_worker
+_worker = {}
+
+
+def config_grid(layer_sizes, activations, learning_rates, dropouts):
+    '''
+    Yields one config dict for every combination of the given values.
+    Each activation name is used for all the hidden layers of a config
+    '''
+    for hidden, act, lr, keep in itertools.product(layer_sizes, activations, learning_rates, dropouts):
+        yield {'layer_sizes': list(hidden), 'activations': [act] * len(hidden),
+               'learning_rate': lr, 'dropout': keep}
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+def _load_done(results_path):
+    if not os.path.exists(results_path):
+        return {}
+    with open(results_path, newline='') as f:
+        return {row['config']: row for row in csv.DictReader(f)}
+
+def _init_worker(X, y, epochs, threads, workdir):
+    # Keep BLAS/OpenMP pools from spawning a thread per core in every worker
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    _worker.update(X=X, y=y, epochs=epochs, threads=threads, workdir=workdir)
+
+def _run_config(config):
+    X, y, epochs = _worker['X'], _worker['y'], _worker['epochs']
+    key = config_key(config)
+    ckpt_dir = os.path.join(_worker['workdir'], hashlib.md5(key.encode('utf-8')).hexdigest()[:12])
+    if not os.path.exists(ckpt_dir):
+        os.makedirs(ckpt_dir)
+    nn = Custom_Nnet(epochs=epochs, summary_steps=0,
+                     ckpt_path=os.path.join(ckpt_dir, 'model.ckpt'),
+                     intra_op_threads=_worker['threads'], inter_op_threads=1, **config)
+    nn.build_graph(X.shape[1])
+    start = time.time()
+    nn.train(X, y)
+    wall_time = time.time() - start
+    final_loss = float(np.sum(np.square(y - nn.predict(X))))
+    return {'config': key, 'final_loss': final_loss, 'wall_time': wall_time,
+            'examples_per_sec': X.shape[0] * epochs / wall_time}
+
+def run_sweep(configs, X, y, results_path, epochs=500, processes=None, threads_per_worker=None,
+              workdir='/tmp/nnet_sweep'):
+    '''
+    Trains every config not yet in results_path on X, y and appends its
+    (config, final loss, wall time, examples/sec) row as soon as it finishes.
+    Returns the rows of the whole table
+    '''
+    done = _load_done(results_path)
+    pending = [c for c in configs if config_key(c) not in done]
+    processes = processes or multiprocessing.cpu_count()
+    threads = threads_per_worker or max(1, multiprocessing.cpu_count() // processes)
+    rows = list(done.values())
+    if not pending:
+        return rows
+    new_file = not os.path.exists(results_path)
+    with open(results_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if new_file:
+            writer.writeheader()
+        pool = multiprocessing.Pool(min(processes, len(pending)), initializer=_init_worker,
+                                    initargs=(X, y, epochs, threads, workdir))
+        try:
+            for row in pool.imap_unordered(_run_config, pending):
+                writer.writerow(row)
+                f.flush()
+                rows.append(row)
+                print('Done:', row['config'], 'loss = %.4f' % row['final_loss'])
+        finally:
+            pool.terminate()
+            pool.join()
+    return rows
+
+def main(argv=None):
+    default_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'Base.csv')
+    parser = argparse.ArgumentParser(description='Grid search Custom_Nnet hyperparameters')
+    parser.add_argument('--data', default=default_data, help='path to Base.csv')
+    parser.add_argument('--hidden', nargs='+', default=['10,10'],
+                        help='hidden layer sizes to try, each as a comma separated list')
+    parser.add_argument('--activations', nargs='+', default=['ReLU'])
+    parser.add_argument('--learning-rates', type=float, nargs='+', default=[1e-4])
+    parser.add_argument('--dropouts', type=float, nargs='+', default=[1])
+    parser.add_argument('--epochs', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None, help='tensorflow threads per worker')
+    parser.add_argument('--results', default='sweep_results.csv')
+    args = parser.parse_args(argv)
+
+    transformer, X, y = build_features(load_data(args.data))
+    layer_sizes = [[int(n) for n in h.split(',')] for h in args.hidden]
+    configs = list(config_grid(layer_sizes, args.activations, args.learning_rates, args.dropouts))
+    rows = run_sweep(configs, X, y, args.results, epochs=args.epochs,
+                     processes=args.processes, threads_per_worker=args.threads)
+    for row in sorted(rows, key=lambda r: float(r['final_loss'])):
+        print(row['config'], row['final_loss'], row['wall_time'], row['examples_per_sec'])
+
+if __name__ == '__main__':
+    main()
@@ -124,14 +124,36 @@ def genPowerSet(L):
     with elements [1], [2], [1,2]
     '''
     powerSet = []
-    for i in range(0, 2**len(L)):
-        binStr = getBinaryRep(i, len(L))
+    n = len(L)
+    for i in range(0, 2**n):
+        # L[j] is in the subset if digit j of the n digit binary
+        # representation of i (what getBinaryRep(i, n) returns) is a 1
         subset = []
-        for j in range(len(binStr)):
-            if binStr[j] == '1':
+        for j in range(n):
+            if (i >> (n - 1 - j)) & 1:
                 subset.append(L[j])
         powerSet.append(subset)
     return powerSet
+
+def iterPowerSet(L, gray = False):
+    '''
+    Assumes L is a list
+    Yields the subsets of L one at a time, as lists, so only one is in memory.
+    Subset number i has L[j] if bit j of i is 1, or with gray = True, bit j
+    of the Gray code of i, so each subset differs from the previous one in
+    a single element
+    '''
+    n = len(L)
+    for i in range(2**n):
+        mask = i ^ (i >> 1) if gray else i
+        subset = []
+        j = 0
+        while mask:
+            if mask & 1:
+                subset.append(L[j])
+            mask >>= 1
+            j += 1
+        yield subset
     
 def chooseBest(pset, constraint, getVal, getWeight):
     bestVal = 0.0
@@ -157,6 +179,252 @@ def testBest(maxWeight = 20):
         
 testBest()
 
+#%% [markdown]
+# ### Dynamic Programming Solution to the 0/1 Knapsack Problem
+# 
+# If the weights are integers (or become integers after multiplying them by a **scale**, e.g. 100 for weights with two decimals) the problem can be solved in time proportional to the number of items times the capacity, instead of 2^n. For every capacity c from 0 to maxWeight we keep the best value that fits in c using the items seen so far, in a single list that is updated item by item from the largest c down, so each item is used at most once. To tell which items were taken we only keep one bit per item and capacity: whether adding that item improved the best value for c.
+
+#%%
+import random
+
+def dpKnapsack(Items, maxWeight, getVal = Item.getValue, getWeight = Item.getWeight, scale = 1):
+    '''
+    Assumes Items is a list, maxWeight >= 0 and the weights times scale are non-negative ints
+    Returns a tuple (taken, totalValue) like chooseBest, where taken is the
+    list of items of the best set
+    '''
+    assert type(Items) == list and maxWeight >= 0
+    # Scaled decimals are not exact (0.29*100 is 28.999...), so round what is an int up to 1e-9
+    capacity = maxWeight*scale
+    if abs(capacity - round(capacity)) <= 1e-9:
+        capacity = int(round(capacity))
+    else:
+        capacity = int(capacity) # weights are ints, the fraction of capacity left can't be used
+    weights = []
+    for item in Items:
+        w = getWeight(item)*scale
+        if w < 0 or abs(w - round(w)) > 1e-9:
+            raise ValueError('weight of ' + str(item) + ' times scale is not a non-negative int')
+        weights.append(int(round(w)))
+    best = [0.0]*(capacity + 1) # best[c] is the best value that fits in weight c
+    improved = [] # improved[i] has bit c set if item i improved best[c]
+    for i in range(len(Items)):
+        w, v = weights[i], getVal(Items[i])
+        bits = bytearray(capacity//8 + 1)
+        for c in range(capacity, w - 1, -1):
+            if best[c - w] + v > best[c]:
+                best[c] = best[c - w] + v
+                bits[c >> 3] |= 1 << (c & 7)
+        improved.append(bits)
+    # Walking back from the full capacity, an item was taken if it improved the best value
+    taken = []
+    c = capacity
+    for i in range(len(Items) - 1, -1, -1):
+        if improved[i][c >> 3] >> (c & 7) & 1:
+            taken.append(Items[i])
+            c -= weights[i]
+    taken.reverse()
+    return (taken, best[capacity])
+
+def buildManyItems(numItems, maxVal, maxWeight):
+    Items = []
+    for i in range(numItems):
+        Items.append(Item(str(i), random.randint(1, maxVal), random.randint(1, maxWeight)))
+    return Items
+
+def testDP(maxWeight = 20):
+    Items = buildItems()
+    taken, val = dpKnapsack(Items, maxWeight)
+    print("Total value of items taken = " + str(val))
+    for item in taken:
+        print(item)
+    Items = buildManyItems(2000, 100, 50)
+    taken, val = dpKnapsack(Items, 1000)
+    print('\n2000 items, maxWeight 1000: ' + str(len(taken)) + ' items taken, total value = ' + str(val))
+    Items = [Item('a', 10, 0.29), Item('b', 12, 0.5), Item('c', 9, 0.21), Item('d', 3, 0.3)]
+    taken, val = dpKnapsack(Items, 0.79, scale = 100)
+    print('\nWeights with two decimals, maxWeight 0.79: total value = ' + str(val)
+          + ' (chooseBest: ' + str(chooseBest(genPowerSet(Items), 0.79, Item.getValue, Item.getWeight)[1]) + ')')
+
+testDP()
+
+#%% [markdown]
+# Enumerating the subsets in **Gray code** order, each subset is the previous one with a single item added or removed, so the value and weight of every subset can be updated with one addition instead of summing the whole subset again, and there is no need to build the subsets at all: only the best one is. The same search can be done on whole blocks of subsets at once with numpy.
+
+#%%
+import math
+
+def maskTotal(L, mask):
+    '''
+    Assumes L is a list of numbers
+    Returns the sum of the L[j] with bit j of mask set, without rounding errors
+    '''
+    return math.fsum(L[j] for j in range(len(L)) if mask >> j & 1)
+
+def chooseBestGray(Items, constraint, getVal, getWeight, tol = 1e-9):
+    '''
+    Same search as chooseBest(genPowerSet(Items), ...) without building the
+    power set: walks the subsets in Gray code order keeping their totals.
+    Weights and values are floats, so a subset is taken as feasible if its
+    weight exceeds constraint by at most tol (relative), and better only if
+    its value is more than tol (relative) above the best one
+    '''
+    vals = [getVal(item) for item in Items]
+    weights = [getWeight(item) for item in Items]
+    maxWeight = constraint + tol*max(1.0, abs(constraint))
+    bestVal = 0.0
+    bestMask = None
+    mask = 0
+    ItemsVal = 0.0
+    ItemsWeight = 0.0
+    for i in range(1, 2**len(Items)):
+        j = (i & -i).bit_length() - 1 # the item that changes between Gray codes i-1 and i
+        mask ^= 1 << j
+        if i & 1023 == 0:
+            # Adding and subtracting piles up rounding errors: start again from exact totals
+            ItemsVal = maskTotal(vals, mask)
+            ItemsWeight = maskTotal(weights, mask)
+        elif mask >> j & 1:
+            ItemsVal += vals[j]
+            ItemsWeight += weights[j]
+        else:
+            ItemsVal -= vals[j]
+            ItemsWeight -= weights[j]
+        if ItemsWeight <= maxWeight and ItemsVal > bestVal + tol*max(1.0, abs(bestVal)):
+            bestVal = ItemsVal
+            bestMask = mask
+    if bestMask is None:
+        return (None, 0.0)
+    return ([Items[j] for j in range(len(Items)) if bestMask >> j & 1], maskTotal(vals, bestMask))
+
+def chooseBestNumpy(Items, constraint, getVal, getWeight, chunkBits = 16, tol = 1e-9):
+    '''
+    Same search as chooseBestGray, 2**chunkBits subsets at a time: the totals
+    of every combination of the first chunkBits items are computed once, and
+    each block adds the totals of one combination of the remaining items
+    '''
+    import numpy as np
+    n = len(Items)
+    vals = np.array([getVal(item) for item in Items], dtype = float)
+    weights = np.array([getWeight(item) for item in Items], dtype = float)
+    maxWeight = constraint + tol*max(1.0, abs(constraint))
+    low = min(n, chunkBits)
+    bits = (np.arange(2**low)[:, None] >> np.arange(low)) & 1
+    lowVals = bits.dot(vals[:low])
+    lowWeights = bits.dot(weights[:low])
+    bestVal = 0.0
+    bestMask = None
+    for high in range(2**(n - low)):
+        highBits = (high >> np.arange(n - low)) & 1
+        ItemsVal = lowVals + highBits.dot(vals[low:])
+        ItemsWeight = lowWeights + highBits.dot(weights[low:])
+        ItemsVal[ItemsWeight > maxWeight] = -np.inf
+        i = int(np.argmax(ItemsVal))
+        if ItemsVal[i] > bestVal + tol*max(1.0, abs(bestVal)):
+            bestVal = float(ItemsVal[i])
+            bestMask = high << low | i
+    if bestMask is None:
+        return (None, 0.0)
+    return ([Items[j] for j in range(n) if bestMask >> j & 1], maskTotal(list(vals), bestMask))
+
+def testPowerSets(numItems = 16, maxWeight = 100):
+    import time
+    # Weights with one decimal, so the float totals are not exact
+    Items = []
+    for i in range(numItems):
+        Items.append(Item(str(i), random.randint(1, 100), random.randint(10, 300)/10.0))
+    print('dpKnapsack with scale = 10 (exact): total value = ' + str(dpKnapsack(Items, maxWeight, scale = 10)[1]))
+    for name, search in [('genPowerSet + chooseBest', lambda: chooseBest(genPowerSet(Items), maxWeight, Item.getValue, Item.getWeight)),
+                         ('chooseBest over iterPowerSet', lambda: chooseBest(iterPowerSet(Items, gray = True), maxWeight, Item.getValue, Item.getWeight)),
+                         ('chooseBestGray', lambda: chooseBestGray(Items, maxWeight, Item.getValue, Item.getWeight)),
+                         ('chooseBestNumpy', lambda: chooseBestNumpy(Items, maxWeight, Item.getValue, Item.getWeight))]:
+        start = time.time()
+        taken, val = search()
+        print(name + ': total value = ' + str(val) + ' in ' + str(round(time.time() - start, 4)) + ' s')
+
+testPowerSets()
+
+#%% [markdown]
+# ### Branch and Bound Solution to the 0/1 Knapsack Problem
+# 
+# An exact search does not need to look at every subset. With the items sorted by density, the best value that can still be reached from a partial choice is at most what we get filling the remaining room greedily and then taking the **fraction** of the next item that fits (the LP relaxation, which is solved exactly by the greedy algorithm by density). Any branch whose bound is not better than the best set found so far, starting with the greedy solution, can be skipped.
+
+#%%
+import bisect
+import time
+
+def branchAndBound(Items, maxWeight, maxNodes = 1000000, maxTime = None):
+    '''
+    Assumes Items is a list of Item with positive weights and maxWeight >= 0
+    Returns a tuple (taken, totalValue, stats) where stats is a dict with the
+    number of nodes expanded, the seconds taken and whether the search
+    finished ('optimal'). When maxNodes nodes were expanded or maxTime
+    seconds passed, the best set found so far is returned
+    '''
+    assert type(Items) == list and maxWeight >= 0
+    start = time.time()
+    ItemsCopy = sorted(Items, key=density, reverse=True)
+    n = len(ItemsCopy)
+    vals = [item.getValue() for item in ItemsCopy]
+    weights = [item.getWeight() for item in ItemsCopy]
+    sumVals = [0.0] # sumVals[k] is the value of the first k items
+    sumWeights = [0.0]
+    for i in range(n):
+        sumVals.append(sumVals[-1] + vals[i])
+        sumWeights.append(sumWeights[-1] + weights[i])
+
+    def bound(i, val, room):
+        # Best value from items i on with room left, taking a fraction of the first item that does not fit
+        k = bisect.bisect_right(sumWeights, sumWeights[i] + room, i) - 1
+        result = val + sumVals[k] - sumVals[i]
+        if k < n:
+            result += (room - (sumWeights[k] - sumWeights[i]))*vals[k]/weights[k]
+        return result
+
+    taken, bestVal = greedy(Items, maxWeight, density)
+    bestPath = None
+    nodes = 0
+    finished = True
+    # Nodes are (next item, value, weight, taken items as (index, parent path))
+    stack = [(0, 0.0, 0.0, None)]
+    while stack:
+        if nodes >= maxNodes or (maxTime is not None and time.time() - start > maxTime):
+            finished = False
+            break
+        i, val, weight, path = stack.pop()
+        nodes += 1
+        if val > bestVal:
+            bestVal = val
+            bestPath = path
+        if i == n or bound(i, val, maxWeight - weight) <= bestVal:
+            continue
+        stack.append((i + 1, val, weight, path))
+        if weight + weights[i] <= maxWeight: # Taking item i is tried first
+            stack.append((i + 1, val + vals[i], weight + weights[i], (i, path)))
+    if bestPath is not None:
+        taken = []
+        while bestPath is not None:
+            taken.append(ItemsCopy[bestPath[0]])
+            bestPath = bestPath[1]
+        taken.reverse()
+    stats = {'nodes': nodes, 'seconds': time.time() - start, 'optimal': finished}
+    return (taken, bestVal, stats)
+
+def testBranchAndBound(maxWeight = 20):
+    Items = buildItems()
+    taken, val, stats = branchAndBound(Items, maxWeight)
+    print("Total value of items taken = " + str(val) + ', nodes expanded = ' + str(stats['nodes']))
+    for item in taken:
+        print(item)
+    for numItems in [100, 250, 500]:
+        Items = buildManyItems(numItems, 100, 50)
+        taken, val, stats = branchAndBound(Items, numItems*5)
+        print('\n' + str(numItems) + ' items: total value = ' + str(val) + ' (dpKnapsack: '
+              + str(dpKnapsack(Items, numItems*5)[1]) + '), nodes expanded = ' + str(stats['nodes'])
+              + ', ' + str(round(stats['seconds']*1000, 1)) + ' ms')
+
+testBranchAndBound()
+
 #%% [markdown]
 # ## Graph Optimization Problems
 # 